@@ -1,13 +1,43 @@
+import argparse
+import collections
+import ctypes
+import functools
+import glob
+import io
+import mmap
+import shutil
+import signal
 import subprocess
+import sys
+import threading
 import time
 import os
+import tomllib
+import zlib
 
 # --- Configuration ---
-DEFAULT_OUTPUT_FILENAME = "recorded_audio_ffmpeg.mp3"
+DEFAULT_OUTPUT_FILENAME = "recorded_audio_ffmpeg.opus"
 DEFAULT_DURATION_HOURS = 24
 DEFAULT_DURATION_MINUTES = 0
 DEFAULT_DURATION_SECONDS = 0
 
+# Encoder settings, chosen by the output file extension.
+# Opus at 96k sounds about as good as MP3 at 192k for half the size and CPU time;
+# use a .mp3 filename when MP3 output is required.
+# "streamable" formats are written strictly front to back, so they can be streamed through
+# a pipe; the MP3 muxer seeks back at the end to fill in its duration (Xing/LAME) header.
+OUTPUT_FORMATS = {
+    ".opus": {"codec": "libopus", "muxer": "opus", "streamable": True, "bitrate": "96k", "sample_rate": 48000, "options": ["-vbr", "on", "-application", "audio"]},
+    ".ogg": {"codec": "libopus", "muxer": "ogg", "streamable": True, "bitrate": "96k", "sample_rate": 48000, "options": ["-vbr", "on", "-application", "audio"]},
+    ".mp3": {"codec": "libmp3lame", "muxer": "mp3", "streamable": False, "bitrate": "192k", "sample_rate": 44100, "options": []},
+}
+
+# The recording is split into self-contained files of this length, named after the
+# output file plus the segment's start time (e.g. recorded_audio_ffmpeg_20250101_120000.opus).
+# Finished segments survive a crash and can be moved or deleted while recording continues.
+# Set to 0 to write a single file instead.
+SEGMENT_DURATION_SECONDS = 3600
+
 # --- IMPORTANT: FFmpeg Audio Source Configuration ---
 # This is system-dependent for capturing desktop/website audio.
 #
@@ -29,6 +59,68 @@ DEFAULT_DURATION_SECONDS = 0
 AUDIO_SOURCE_FORMAT = "pulse" # "pulse" for PulseAudio/PipeWire, "alsa" for ALSA
 AUDIO_SOURCE_DEVICE = "alsa_output.pci-0000_03_00.6.analog-stereo.monitor" # Device name, e.g., "default", "hw:0,0", or a monitor source name
 
+# "ffmpeg" runs the ffmpeg command-line tool in a subprocess.
+# "pyav" records in-process with PyAV, the Python bindings for the libraries ffmpeg
+# is built on (pip install av). Same codecs and segmenting, no child process.
+# Also selectable per run with --backend.
+RECORDING_BACKENDS = ("ffmpeg", "pyav")
+RECORDING_BACKEND = "ffmpeg"
+
+# ffmpeg options that are the same for every recording.
+# -y: Overwrite output file if it exists
+# -nostats: Don't show stats during encoding
+# -loglevel warning: Only show warnings and errors
+# (stdin stays enabled: sending "q" is how a recording is stopped early, see FFMPEG_STOP_TIMEOUT_SECONDS)
+_FFMPEG_GLOBAL_OPTIONS = ("-y", "-nostats", "-loglevel", "warning")
+# -thread_queue_size: Packets buffered from the capture device (default 8 drops samples under load)
+_FFMPEG_INPUT_OPTIONS = ("-thread_queue_size", "4096")
+# -threads: Encoder threads
+# -flush_packets 1: Write each packet to disk as it is produced, bounding loss on a crash
+_FFMPEG_OUTPUT_OPTIONS = ("-threads", "2", "-flush_packets", "1")
+
+# To stop a recording early, ffmpeg is sent "q" on stdin, which makes it flush and finalize
+# the output file (e.g. the MP3 duration header) so the partial recording stays playable
+# and seekable. It is only terminated, and then killed, if it hasn't exited after this long.
+FFMPEG_STOP_TIMEOUT_SECONDS = 10
+
+# Only the tail of ffmpeg's stderr is kept for error reporting, so memory use
+# stays bounded no matter how long the recording runs.
+STDERR_CHUNK_SIZE = 4096
+STDERR_MAX_CHUNKS = 256
+
+# Scheduling priority for the ffmpeg process. A negative niceness helps avoid dropouts
+# when the desktop is busy, but needs CAP_SYS_NICE (or a raised RLIMIT_NICE); without
+# it ffmpeg simply runs at normal priority.
+FFMPEG_NICENESS = -5
+
+# prctl() option asking the kernel to signal a process when its parent dies (Linux only).
+_PR_SET_PDEATHSIG = 1
+
+# How long to wait for `pactl` before giving up on auto-detecting a monitor source.
+# A misconfigured PulseAudio server can otherwise hang startup indefinitely.
+PACTL_TIMEOUT_SECONDS = 2.0
+
+# When writing a single file in a streamable format (see OUTPUT_FORMATS), ffmpeg
+# streams its output through this script, which
+# keeps up to OUTPUT_BUFFER_BLOCKS blocks of OUTPUT_BLOCK_SIZE bytes (10 MB) in memory.
+# That absorbs disk stalls (e.g. fsync on a network home directory) which would
+# otherwise block ffmpeg and make it drop input samples.
+OUTPUT_BLOCK_SIZE = 64 * 1024
+OUTPUT_BUFFER_BLOCKS = 160
+
+# Recorded files are checksummed in slices of this size after recording.
+VERIFY_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Keys accepted in a --config TOML file, with the value types each may have.
+_CONFIG_FILE_TYPES = {
+    "output": (str,),
+    "duration": (int, str),
+    "source": (str,),
+    "format": (str,),
+    "yes": (bool,),
+    "backend": (str,),
+}
+
 def get_user_input():
     """
     Prompts user for recording parameters.
@@ -43,9 +135,9 @@ def get_user_input():
     default_name = DEFAULT_OUTPUT_FILENAME
     filename_input = input(f"Output filename [{default_name}]: ").strip()
     filename = filename_input if filename_input else default_name
-    # Ensure .mp3 extension
-    if not filename.lower().endswith('.mp3'):
-        filename += '.mp3'
+    # Ensure a supported extension, since it selects the codec
+    if os.path.splitext(filename)[1].lower() not in OUTPUT_FORMATS:
+        filename += os.path.splitext(DEFAULT_OUTPUT_FILENAME)[1]
     
     # Get duration
     try:
@@ -67,106 +159,443 @@ def get_user_input():
         print("Warning: Invalid input. Using default duration of 24 hours.")
         total_seconds = 24 * 3600
     
+    confirm_settings(filename, total_seconds, AUDIO_SOURCE_FORMAT, AUDIO_SOURCE_DEVICE)
+    
+    return filename, total_seconds
+
+def confirm_settings(filename: str, total_seconds: int, audio_format: str, audio_device: str):
+    """
+    Prints the recording settings and asks the user to confirm them. Exits if they decline.
+    """
+    minutes, seconds = divmod(total_seconds, 60)
+    hours, minutes = divmod(minutes, 60)
     print("\nConfig Summary:")
     print(f"- Output file: {filename}")
     print(f"- Recording duration: {hours}h {minutes}m {seconds}s ({total_seconds} seconds)")
-    print(f"- Audio source: {AUDIO_SOURCE_FORMAT}:{AUDIO_SOURCE_DEVICE}")
+    print(f"- Audio source: {audio_format}:{audio_device}")
     
-    # Confirm settings
     confirm = input("\nProceed with these settings? [Y/n]: ").strip().lower()
     if confirm and confirm[0] != 'y':
         print("Recording cancelled.")
-        exit(0)
-    
-    return filename, total_seconds
+        sys.exit(0)
 
-def check_ffmpeg_installed():
-    """Checks if ffmpeg is installed and accessible."""
+def _parse_duration(value: str) -> int:
+    """Parses a duration given as SECONDS, MM:SS or HH:MM:SS into a number of seconds."""
+    try:
+        parts = [int(part) for part in value.split(":")]
+    except ValueError:
+        parts = []
+    total_seconds = 0
+    for part in parts:
+        total_seconds = total_seconds * 60 + part
+    if not 1 <= len(parts) <= 3 or min(parts) < 0 or total_seconds <= 0:
+        raise argparse.ArgumentTypeError(f"invalid duration '{value}', expected SECONDS, MM:SS or HH:MM:SS")
+    return total_seconds
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    """
+    Parses command-line options, filling in anything not given on the command line from
+    the --config TOML file. Options given in neither place are None (or False for --yes).
+    """
+    parser = argparse.ArgumentParser(description="Record system audio to a file without playing it through the speakers.")
+    parser.add_argument("-o", "--output", help=f"output file; its extension selects the codec (default: {DEFAULT_OUTPUT_FILENAME})")
+    parser.add_argument("-d", "--duration", type=_parse_duration,
+                        help="recording length as SECONDS, MM:SS or HH:MM:SS (default: 24 hours)")
+    parser.add_argument("--source", help=f"audio device to record from (default: {AUDIO_SOURCE_DEVICE})")
+    parser.add_argument("--format", help=f"audio input format, e.g. pulse or alsa (default: {AUDIO_SOURCE_FORMAT})")
+    parser.add_argument("--backend", choices=RECORDING_BACKENDS,
+                        help=f"record with the ffmpeg command-line tool or in-process with PyAV (default: {RECORDING_BACKEND})")
+    parser.add_argument("-y", "--yes", action="store_true", default=None, help="start recording without asking for confirmation")
+    parser.add_argument("--config", help="TOML file with any of the keys output, duration, source, format, backend and yes")
+    args = parser.parse_args(argv)
+
+    if args.config:
+        try:
+            with open(args.config, "rb") as f:
+                config = tomllib.load(f)
+        except (OSError, tomllib.TOMLDecodeError) as e:
+            parser.error(f"could not read config file {args.config}: {e}")
+        unknown = set(config) - set(_CONFIG_FILE_TYPES)
+        if unknown:
+            parser.error(f"unknown keys in config file {args.config}: {', '.join(sorted(unknown))}")
+        for key, value in config.items():
+            # bool is a subclass of int, so `duration = true` has to be rejected explicitly
+            if not isinstance(value, _CONFIG_FILE_TYPES[key]) or (isinstance(value, bool) and key != "yes"):
+                expected = " or ".join(t.__name__ for t in _CONFIG_FILE_TYPES[key])
+                parser.error(f"{args.config}: '{key}' must be {expected}, not {value!r}")
+            if getattr(args, key) is not None:
+                continue
+            if key == "duration":
+                try:
+                    value = _parse_duration(str(value))
+                except argparse.ArgumentTypeError as e:
+                    parser.error(f"{args.config}: {e}")
+            setattr(args, key, value)
+    if args.backend is not None and args.backend not in RECORDING_BACKENDS:
+        parser.error(f"{args.config}: 'backend' must be one of: {', '.join(RECORDING_BACKENDS)}")
+    if args.output and os.path.splitext(args.output)[1].lower() not in OUTPUT_FORMATS:
+        parser.error(f"unsupported output file extension in '{args.output}', use one of: {', '.join(OUTPUT_FORMATS)}")
+    args.yes = bool(args.yes)
+    return args
+
+# (path, mtime) of the ffmpeg executable found by the last PATH search, see _ffmpeg_path()
+_ffmpeg_cache = None
+
+def _ffmpeg_path():
+    """
+    Returns the absolute path of the ffmpeg executable on PATH, or None if it is not installed.
+    The PATH search is cached and only repeated if the cached binary disappears or its mtime
+    changes (e.g. ffmpeg was upgraded or removed), so later lookups cost a single stat().
+    """
+    global _ffmpeg_cache
+    if _ffmpeg_cache is not None:
+        path, mtime_ns = _ffmpeg_cache
+        try:
+            if os.stat(path).st_mtime_ns == mtime_ns:
+                return path
+        except OSError:
+            pass
+        _ffmpeg_cache = None
+    path = shutil.which("ffmpeg")
+    if path is None:
+        return None
     try:
-        subprocess.run(["ffmpeg", "-version"], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        print("ffmpeg is installed.")
-        return True
-    except (subprocess.CalledProcessError, FileNotFoundError):
+        _ffmpeg_cache = (path, os.stat(path).st_mtime_ns)
+    except OSError:
+        return None
+    return path
+
+def check_ffmpeg_installed():
+    """
+    Checks if ffmpeg is installed and accessible.
+
+    Returns:
+        str: The path of the ffmpeg executable, or None if it was not found.
+    """
+    ffmpeg_path = _ffmpeg_path()
+    if ffmpeg_path is None:
         print("Error: ffmpeg does not appear to be installed or is not in your PATH.")
         print("Please install ffmpeg. For Ubuntu: sudo apt update && sudo apt install ffmpeg")
+        return None
+    print("ffmpeg is installed.")
+    return ffmpeg_path
+
+def _drain_stderr(stream, tail: collections.deque):
+    """
+    Reads ffmpeg's stderr in fixed-size chunks until EOF, keeping only the most
+    recent chunks in `tail`. Runs on a background thread so the pipe never fills up,
+    and decodes the text as it arrives rather than all at once after ffmpeg exits.
+    """
+    stream = io.TextIOWrapper(stream, encoding='utf-8', errors='replace')
+    for chunk in iter(lambda: stream.read(STDERR_CHUNK_SIZE), ''):
+        tail.append(chunk)
+    stream.close()
+
+def _read_output_blocks(fd: int, blocks: collections.deque, changed: threading.Condition):
+    """
+    Producer side of the output ring buffer: reads ffmpeg's output from the pipe `fd`
+    into `blocks`, waiting while the buffer is full. Appends None once ffmpeg closes the pipe.
+    """
+    while True:
+        block = os.read(fd, OUTPUT_BLOCK_SIZE)
+        with changed:
+            while len(blocks) >= OUTPUT_BUFFER_BLOCKS:
+                changed.wait()
+            blocks.append(block or None)
+            changed.notify_all()
+        if not block:
+            return
+
+def _write_output_blocks(fd: int, blocks: collections.deque, changed: threading.Condition):
+    """
+    Consumer side of the output ring buffer: writes everything queued in `blocks` to the
+    file `fd` with a single writev() per batch, until the None end marker arrives.
+    """
+    write_failed = False
+    while True:
+        with changed:
+            while not blocks:
+                changed.wait()
+            pending = list(blocks)
+            blocks.clear()
+            changed.notify_all()
+        finished = pending[-1] is None
+        if finished:
+            pending.pop()
+        # A failed write (e.g. disk full) is reported once; later output is discarded
+        # rather than blocking, so ffmpeg can still run to completion.
+        while pending and not write_failed:
+            try:
+                written = os.writev(fd, pending)
+            except OSError as e:
+                print(f"Error writing the recording to disk: {e}")
+                write_failed = True
+                break
+            # writev() may stop part-way through the batch
+            while pending and written >= len(pending[0]):
+                written -= len(pending.pop(0))
+            if written:
+                pending[0] = pending[0][written:]
+        if finished:
+            os.close(fd)
+            return
+
+def _start_buffered_output(stream, output_fd: int) -> list[threading.Thread]:
+    """
+    Copies ffmpeg's piped output `stream` into the file `output_fd` through an in-memory
+    ring buffer. Returns the reader and writer threads; both exit once ffmpeg closes the pipe.
+    """
+    blocks = collections.deque()
+    changed = threading.Condition()
+    threads = [
+        threading.Thread(target=_read_output_blocks, args=(stream.fileno(), blocks, changed), daemon=True),
+        threading.Thread(target=_write_output_blocks, args=(output_fd, blocks, changed), daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+    return threads
+
+def _stop_ffmpeg(process: subprocess.Popen):
+    """
+    Asks ffmpeg to finish the recording early, escalating to SIGTERM and then SIGKILL
+    if it doesn't exit in time.
+    """
+    try:
+        process.stdin.write(b"q\n")
+        process.stdin.close()
+    except BrokenPipeError:
+        pass  # ffmpeg has already exited; close() still released the pipe
+    try:
+        process.wait(timeout=FFMPEG_STOP_TIMEOUT_SECONDS)
+        print("ffmpeg finished writing the output and exited cleanly.")
+        return
+    except subprocess.TimeoutExpired:
+        print("ffmpeg did not stop when asked, terminating...")
+    process.terminate()
+    try:
+        process.wait(timeout=5)
+        print("ffmpeg process terminated.")
+    except subprocess.TimeoutExpired:
+        print("ffmpeg process did not terminate cleanly, forcing...")
+        process.kill()
+        process.wait()
+
+def _load_prctl():
+    """Returns libc's prctl() function, or None where it isn't available."""
+    try:
+        return ctypes.CDLL(None, use_errno=True).prctl
+    except (OSError, AttributeError):
+        return None
+
+def _prepare_ffmpeg_process(parent_pid: int, prctl):
+    """
+    Runs in the ffmpeg child just before exec. ffmpeg has its own session, so it gets no
+    SIGHUP when the terminal closes; instead the kernel is asked to send it SIGTERM (which
+    ffmpeg handles by finalizing the output) as soon as this script dies for any reason.
+    Also tries to raise its CPU priority; lacking the privilege to do so is not an error.
+    """
+    if prctl is not None:
+        prctl(_PR_SET_PDEATHSIG, int(signal.SIGTERM))
+        # The script may have died before the request took effect
+        if os.getppid() != parent_pid:
+            os._exit(1)
+    try:
+        os.setpriority(os.PRIO_PROCESS, 0, FFMPEG_NICENESS)
+    except PermissionError:
+        pass
+
+def _segment_pattern(output_filename: str) -> str:
+    """Returns the strftime pattern ffmpeg's segment muxer uses to name the segments of `output_filename`."""
+    stem, extension = os.path.splitext(output_filename)
+    return f"{stem.replace('%', '%%')}_%Y%m%d_%H%M%S{extension}"
+
+def _is_non_empty_file(path: str) -> bool:
+    """Checks that `path` exists and has data, using a single stat() call."""
+    try:
+        return os.stat(path).st_size > 0
+    except FileNotFoundError:
         return False
 
+def _recorded_files(output_filename: str, started_at: float) -> list[str]:
+    """
+    Returns the non-empty files written for `output_filename` by a recording started at `started_at`.
+    """
+    if not SEGMENT_DURATION_SECONDS:
+        candidates = [output_filename]
+    else:
+        stem, extension = os.path.splitext(output_filename)
+        timestamp = "[0-9]" * 8 + "_" + "[0-9]" * 6
+        # Segment names sort chronologically, so anything at or after the first
+        # segment's name belongs to this recording rather than an earlier one.
+        first_segment = time.strftime(_segment_pattern(output_filename), time.localtime(started_at))
+        candidates = [path for path in sorted(glob.glob(f"{glob.escape(stem)}_{timestamp}{glob.escape(extension)}"))
+                      if path >= first_segment]
+    return [path for path in candidates if _is_non_empty_file(path)]
+
+def _verify_output(path: str):
+    """
+    Prints the CRC32 and size of a recorded file so copies can be compared between sessions.
+    The file is memory-mapped and checksummed with zlib, which runs at memory speed, so
+    this takes well under a second even for a multi-gigabyte recording.
+    """
+    try:
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                crc = 0
+                with memoryview(mapped) as view:
+                    for offset in range(0, len(view), VERIFY_CHUNK_SIZE):
+                        crc = zlib.crc32(view[offset:offset + VERIFY_CHUNK_SIZE], crc)
+                size = len(mapped)
+    except (OSError, ValueError) as e:
+        # e.g. the file was removed meanwhile, or is empty (mmap can't map 0 bytes)
+        print(f"  {path}: could not verify: {e}")
+        return
+    print(f"  {path}: {size} bytes, CRC32 {crc:08x}")
+
+def _output_format(output_filename: str):
+    """Returns the OUTPUT_FORMATS entry for the file's extension, or None (after reporting it) if unsupported."""
+    extension = os.path.splitext(output_filename)[1].lower()
+    output_format = OUTPUT_FORMATS.get(extension)
+    if output_format is None:
+        print(f"Error: unsupported output file extension '{extension}'. Use one of: {', '.join(OUTPUT_FORMATS)}")
+    return output_format
+
 def record_audio_ffmpeg(output_filename: str, duration_seconds: int, audio_format: str, audio_device: str):
     """
     Records audio using ffmpeg for a specified duration from a given audio source.
     """
-    if not check_ffmpeg_installed():
+    output_format = _output_format(output_filename)
+    if output_format is None:
+        return
+
+    ffmpeg_path = check_ffmpeg_installed()
+    if ffmpeg_path is None:
         return
 
     print(f"Starting ffmpeg recording for {duration_seconds} seconds...")
     print(f"Output file: {output_filename}")
+    if SEGMENT_DURATION_SECONDS:
+        print(f"A new file is started every {SEGMENT_DURATION_SECONDS} seconds, named after the output file and its start time.")
     print(f"Using audio format: {audio_format} and device: {audio_device}")
     
     # Calculate expected end time
     end_time = time.time() + duration_seconds
     end_time_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(end_time))
     print(f"Recording will complete at approximately: {end_time_str}")
-    print("If this fails, you likely need to adjust AUDIO_SOURCE_FORMAT and AUDIO_SOURCE_DEVICE in the script.")
-    
-    # Construct the ffmpeg command
-    # -y: Overwrite output file if it exists
+    print("If this fails, you likely need to adjust the audio format and device (--format and --source, or AUDIO_SOURCE_FORMAT and AUDIO_SOURCE_DEVICE in the script).")
+
+    # Construct the ffmpeg command from the fixed _FFMPEG_*_OPTIONS plus this recording's settings
     # -f: Input format (e.g., alsa, pulse)
     # -i: Input device/source
     # -t: Duration of recording
-    # -acodec: Audio codec (libmp3lame for MP3)
-    # -b:a: Audio bitrate for MP3 quality
-    # -nostdin: Don't expect any input from stdin (useful for background operation)
-    # -nostats: Don't show stats during encoding
-    # -loglevel warning: Only show warnings and errors
+    # -c:a: Audio codec (libopus or libmp3lame, depending on the output extension)
+    # -b:a: Audio bitrate
+    # -f segment: Start a new output file every SEGMENT_DURATION_SECONDS, named by its start time
+    #   (otherwise, for streamable formats, -f <muxer> pipe:1: Stream a single file to this
+    #   script, see OUTPUT_BUFFER_BLOCKS; other formats are written directly)
     command = [
-        "ffmpeg",
-        "-y",
+        ffmpeg_path,              # Already resolved, so Popen skips the PATH search
+        *_FFMPEG_GLOBAL_OPTIONS,
         "-f", audio_format,
+        *_FFMPEG_INPUT_OPTIONS,
         "-i", audio_device,
         "-t", str(duration_seconds),
-        "-acodec", "libmp3lame",  # MP3 codec
-        "-b:a", "192k",           # Audio bitrate for MP3 quality
-        "-nostdin",               # Don't expect stdin input
-        "-nostats",               # Don't show stats during encoding
-        "-loglevel", "warning",   # Only show warnings and errors
-        output_filename
+        *_FFMPEG_OUTPUT_OPTIONS,
+        "-c:a", output_format["codec"],
+        "-b:a", output_format["bitrate"],
+        *output_format["options"],
     ]
+    if SEGMENT_DURATION_SECONDS:
+        command += [
+            "-f", "segment",
+            "-segment_time", str(SEGMENT_DURATION_SECONDS),
+            "-reset_timestamps", "1",  # Each segment starts at t=0 so it plays on its own
+            "-strftime", "1",          # Expand the time placeholders in the segment names
+            _segment_pattern(output_filename),
+        ]
+    elif output_format["streamable"]:
+        command += ["-f", output_format["muxer"], "pipe:1"]
+    else:
+        command.append(output_filename)
+    buffered_output = not SEGMENT_DURATION_SECONDS and output_format["streamable"]
+
+    # Run ffmpeg in the highest best-effort IO class so disk flushes don't starve the encoder.
+    ionice_path = shutil.which("ionice")
+    if ionice_path:
+        command = [ionice_path, "-c", "2", "-n", "0"] + command
+
+    # A streamed output file is opened up front so an unwritable path fails before ffmpeg
+    # starts, but an existing file is only truncated once ffmpeg is actually running.
+    output_fd = None
+    if buffered_output:
+        try:
+            output_fd = os.open(output_filename, os.O_WRONLY | os.O_CREAT, 0o644)
+        except OSError as e:
+            print(f"Error: cannot open output file {output_filename}: {e}")
+            return
 
     try:
         print(f"Executing command: {' '.join(command)}")
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        started_at = time.time()
+        # stdout carries the recording when it is streamed through this script and is unused otherwise;
+        # stderr is drained by a background thread into a bounded buffer instead of
+        # communicate(), which would hold the entire log in memory for the whole recording.
+        # ffmpeg gets its own session so a Ctrl+C in the terminal reaches only this script,
+        # which then shuts ffmpeg down itself (see the KeyboardInterrupt handler below).
+        try:
+            process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                       stdout=subprocess.DEVNULL if output_fd is None else subprocess.PIPE,
+                                       stderr=subprocess.PIPE, start_new_session=True,
+                                       preexec_fn=functools.partial(_prepare_ffmpeg_process, os.getpid(), _load_prctl()))
+        except BaseException:
+            if output_fd is not None:
+                os.close(output_fd)
+            raise
+        output_threads = []
+        if output_fd is not None:
+            os.ftruncate(output_fd, 0)
+            output_threads = _start_buffered_output(process.stdout, output_fd)
+        stderr_tail = collections.deque(maxlen=STDERR_MAX_CHUNKS)
+        stderr_thread = threading.Thread(target=_drain_stderr, args=(process.stderr, stderr_tail), daemon=True)
+        stderr_thread.start()
         
         print("Recording in progress... The audio is being captured silently.")
         print("Press Ctrl+C to stop recording early (output file will contain what was recorded so far).")
         
         try:
             # Wait for the process to complete. ffmpeg will handle the duration via -t.
-            stdout, stderr = process.communicate() 
+            returncode = process.wait()
+            for thread in output_threads:
+                thread.join()
+            stderr_thread.join()
+            stderr = ''.join(stderr_tail)
 
-            if process.returncode == 0:
+            if returncode == 0:
                 print("ffmpeg recording finished successfully.")
-                if os.path.exists(output_filename) and os.path.getsize(output_filename) > 0:
-                    print(f"Audio saved to {output_filename}")
+                recorded_files = _recorded_files(output_filename, started_at)
+                if recorded_files:
+                    print(f"Audio saved to {', '.join(recorded_files)}")
+                    for path in recorded_files:
+                        _verify_output(path)
                 else:
                     print(f"ffmpeg reported success, but the output file {output_filename} is missing or empty.")
                     print("This can happen if the audio source is silent or not capturing correctly.")
-                    print("ffmpeg stderr:", stderr.decode(errors='ignore'))
+                    print("ffmpeg stderr:", stderr)
             else:
-                print(f"Error during ffmpeg recording. Return code: {process.returncode}")
-                print("ffmpeg stderr:", stderr.decode(errors='ignore'))
+                print(f"Error during ffmpeg recording. Return code: {returncode}")
+                print("ffmpeg stderr:", stderr)
                 print("Please check the audio source and ffmpeg installation.")
         except KeyboardInterrupt:
             print("\nRecording stopped early by user.")
-            process.terminate()
-            try:
-                process.wait(timeout=5)
-                print("ffmpeg process terminated cleanly.")
-            except subprocess.TimeoutExpired:
-                print("ffmpeg process did not terminate cleanly, forcing...")
-                process.kill()
+            _stop_ffmpeg(process)
+            for thread in output_threads:
+                thread.join()
             
-            if os.path.exists(output_filename) and os.path.getsize(output_filename) > 0:
-                print(f"Partial recording saved to {output_filename}")
+            recorded_files = _recorded_files(output_filename, started_at)
+            if recorded_files:
+                print(f"Partial recording saved to {', '.join(recorded_files)}")
+                for path in recorded_files:
+                    _verify_output(path)
             else:
                 print("No usable output file was created before termination.")
 
@@ -175,74 +604,202 @@ def record_audio_ffmpeg(output_filename: str, duration_seconds: int, audio_forma
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
 
+def record_audio_pyav(output_filename: str, duration_seconds: int, audio_format: str, audio_device: str):
+    """
+    Records audio in-process with PyAV for a specified duration from a given audio source.
+    Produces the same files as record_audio_ffmpeg without spawning ffmpeg.
+    """
+    # PyAV is optional and slow to import, so it is only loaded when this backend is used
+    try:
+        import av
+    except ImportError:
+        print("Error: the pyav recording backend needs PyAV. Install it with: pip install av")
+        return
+
+    output_format = _output_format(output_filename)
+    if output_format is None:
+        return
+
+    print(f"Starting PyAV recording for {duration_seconds} seconds...")
+    print(f"Output file: {output_filename}")
+    if SEGMENT_DURATION_SECONDS:
+        print(f"A new file is started every {SEGMENT_DURATION_SECONDS} seconds, named after the output file and its start time.")
+    print(f"Using audio format: {audio_format} and device: {audio_device}")
+
+    end_time = time.time() + duration_seconds
+    end_time_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(end_time))
+    print(f"Recording will complete at approximately: {end_time_str}")
+    print("If this fails, you likely need to adjust the audio format and device (--format and --source, or AUDIO_SOURCE_FORMAT and AUDIO_SOURCE_DEVICE in the script).")
+
+    started_at = time.time()
+    try:
+        input_container = av.open(audio_device, format=audio_format)
+    except av.error.FFmpegError as e:
+        print(f"Error: could not open audio source {audio_format}:{audio_device}: {e}")
+        return
+
+    # The OUTPUT_FORMATS options are written for the ffmpeg CLI ("-vbr", "on", ...);
+    # PyAV takes the same encoder options as a dict without the dashes.
+    options = output_format["options"]
+    codec_options = {name.lstrip("-"): value for name, value in zip(options[::2], options[1::2])}
+    output_container = None
+    try:
+        if SEGMENT_DURATION_SECONDS:
+            output_container = av.open(_segment_pattern(output_filename), mode="w", format="segment", options={
+                "segment_time": str(SEGMENT_DURATION_SECONDS),
+                "reset_timestamps": "1",
+                "strftime": "1",
+            })
+        else:
+            output_container = av.open(output_filename, mode="w")
+        output_stream = output_container.add_stream(output_format["codec"], rate=output_format["sample_rate"],
+                                                    options=codec_options)
+        output_stream.layout = "stereo"
+        output_stream.bit_rate = int(output_format["bitrate"].rstrip("k")) * 1000
+        # Open the encoder now rather than on the first mux() so its frame size is known
+        output_stream.codec_context.open()
+    except av.error.FFmpegError as e:
+        if output_container is not None:
+            output_container.close()
+        input_container.close()
+        print(f"Error: could not create output {output_filename}: {e}")
+        return
+
+    # Converts captured frames to the encoder's sample format and rate, in frames of
+    # the size the encoder expects (e.g. 960 samples for Opus; 0 means any size).
+    resampler = av.AudioResampler(format=output_stream.format, layout=output_stream.layout,
+                                  rate=output_stream.rate, frame_size=output_stream.codec_context.frame_size or None)
+
+    print("Recording in progress... The audio is being captured silently.")
+    print("Press Ctrl+C to stop recording early (output file will contain what was recorded so far).")
+
+    recorded_seconds = 0.0
+    stopped_early = False
+    try:
+        for frame in input_container.decode(audio=0):
+            frame.pts = None
+            for resampled in resampler.resample(frame):
+                output_container.mux(output_stream.encode(resampled))
+            recorded_seconds += frame.samples / frame.sample_rate
+            if recorded_seconds >= duration_seconds:
+                break
+    except KeyboardInterrupt:
+        print("\nRecording stopped early by user.")
+        stopped_early = True
+    except av.error.FFmpegError as e:
+        print(f"Error during PyAV recording: {e}")
+    finally:
+        # Flush buffered samples and finalize the current file so it stays playable.
+        # If recording failed while writing (e.g. a full disk), this can fail again.
+        try:
+            for resampled in resampler.resample(None):
+                output_container.mux(output_stream.encode(resampled))
+            output_container.mux(output_stream.encode(None))
+        except av.error.FFmpegError as e:
+            print(f"Error finalizing the recording: {e}")
+        finally:
+            try:
+                output_container.close()
+            except av.error.FFmpegError as e:
+                print(f"Error closing the output file: {e}")
+            finally:
+                input_container.close()
+
+    recorded_files = _recorded_files(output_filename, started_at)
+    if recorded_files:
+        print(f"{'Partial recording' if stopped_early else 'Audio'} saved to {', '.join(recorded_files)}")
+        for path in recorded_files:
+            _verify_output(path)
+    else:
+        print("No usable output file was created.")
+        print("This can happen if the audio source is silent or not capturing correctly.")
+
 def detect_pulseaudio_monitor_source():
     """
     Attempts to detect a PulseAudio monitor source for capturing system audio.
     Returns the name of a suitable monitor source, or None if not found.
     """
     try:
-        result = subprocess.run(["pactl", "list", "sources"], 
+        result = subprocess.run(["pactl", "list", "sources", "short"],
                                stdout=subprocess.PIPE, 
-                               stderr=subprocess.PIPE,
-                               text=True)
+                               stderr=subprocess.DEVNULL,
+                               text=True,
+                               timeout=PACTL_TIMEOUT_SECONDS)
         
         if result.returncode != 0:
             return None
             
-        # Look for monitor sources in the output
-        lines = result.stdout.split('\n')
-        monitor_sources = []
-        current_name = None
-        
-        for line in lines:
-            if line.strip().startswith('Name:'):
-                current_name = line.split(':', 1)[1].strip()
-            elif '.monitor' in line and current_name:
-                monitor_sources.append(current_name)
-                
-        # Prefer sources with 'monitor' in the name
-        for source in monitor_sources:
-            if 'monitor' in source:
-                return source
-                
-        # If no clear monitor source found, return the first one if available
+        # Each line is tab-separated: index, name, driver, sample spec, state
+        rows = (line.split('\t') for line in result.stdout.splitlines())
+        monitor_sources = [row[1] for row in rows if len(row) > 1 and row[1].endswith('.monitor')]
         return monitor_sources[0] if monitor_sources else None
         
     except (subprocess.SubprocessError, FileNotFoundError):
         return None
 
-def main():
+def _stop_on_sigterm(signum, frame):
+    """Handles SIGTERM (e.g. `systemctl stop`) like Ctrl+C, so the recording is finalized properly."""
+    raise KeyboardInterrupt
+
+def main(argv: list[str] | None = None):
     """
     Main function to orchestrate audio recording using ffmpeg.
+    
+    With no command-line options on an interactive terminal, the recording settings are
+    prompted for; otherwise they come from the options (see parse_args) and the defaults
+    above, so the script can run unattended from cron or systemd.
     """
+    if argv is None:
+        argv = sys.argv[1:]
+    args = parse_args(argv)
+
     print("Audio Capture Application using ffmpeg")
     print("--------------------------------------")
     print("This application will record audio without playing it through speakers.")
     
+    audio_format = args.format or AUDIO_SOURCE_FORMAT
+    audio_device = args.source or AUDIO_SOURCE_DEVICE
+
     # Try to auto-detect a suitable monitor source for PulseAudio
-    monitor_source = detect_pulseaudio_monitor_source()
-    if monitor_source:
-        print(f"Found potential monitor source: {monitor_source}")
-        print("This source might be suitable for capturing system audio.")
-        print(f'You can edit this script to use it by setting AUDIO_SOURCE_DEVICE = "{monitor_source}"')
+    if not args.source:
+        monitor_source = detect_pulseaudio_monitor_source()
+        if monitor_source:
+            print(f"Found potential monitor source: {monitor_source}")
+            print("This source might be suitable for capturing system audio.")
+            print(f'You can use it with --source {monitor_source} or by setting AUDIO_SOURCE_DEVICE = "{monitor_source}" in this script')
     
-    # Get user input for filename and duration
-    filename, duration = get_user_input()
+    if not argv and sys.stdin.isatty():
+        # Get user input for filename and duration
+        filename, duration = get_user_input()
+    else:
+        filename = args.output or DEFAULT_OUTPUT_FILENAME
+        duration = args.duration or (DEFAULT_DURATION_HOURS * 3600 + DEFAULT_DURATION_MINUTES * 60 + DEFAULT_DURATION_SECONDS)
+        if not args.yes and sys.stdin.isatty():
+            confirm_settings(filename, duration, audio_format, audio_device)
 
-    # Record audio using ffmpeg
-    record_audio_ffmpeg(filename, duration, AUDIO_SOURCE_FORMAT, AUDIO_SOURCE_DEVICE)
+    # Record audio with the configured backend. SIGTERM is only turned into a KeyboardInterrupt
+    # while recording, where it is caught; during the prompts it keeps its default behaviour.
+    previous_sigterm_handler = signal.signal(signal.SIGTERM, _stop_on_sigterm)
+    try:
+        if (args.backend or RECORDING_BACKEND) == "pyav":
+            record_audio_pyav(filename, duration, audio_format, audio_device)
+        else:
+            record_audio_ffmpeg(filename, duration, audio_format, audio_device)
+    finally:
+        signal.signal(signal.SIGTERM, previous_sigterm_handler)
 
     print("\n--- Troubleshooting --- ")
     print("If recording fails or the file is silent:")
     print("1. Ensure ffmpeg is installed (`sudo apt install ffmpeg`).")
-    print(f"2. Verify AUDIO_SOURCE_FORMAT ('{AUDIO_SOURCE_FORMAT}') and AUDIO_SOURCE_DEVICE ('{AUDIO_SOURCE_DEVICE}') are correct for your system.")
+    print(f"2. Verify the audio format ('{audio_format}') and device ('{audio_device}') are correct for your system.")
+    print("   Set them with --format and --source, or with AUDIO_SOURCE_FORMAT and AUDIO_SOURCE_DEVICE in this script.")
     print("   - For PulseAudio/PipeWire (common on Ubuntu desktops):")
     print("     Run `pactl list sources short` in your terminal.")
     print("     Look for a 'monitor' source, e.g., 'alsa_output.pci-0000_00_1f.3.analog-stereo.monitor'.")
-    print("     Set AUDIO_SOURCE_FORMAT = \"pulse\" and AUDIO_SOURCE_DEVICE = <your_monitor_source_name>.")
+    print("     Use format \"pulse\" and device <your_monitor_source_name>.")
     print("   - For ALSA directly (less common if Pulse/PipeWire is active):")
     print("     Run `arecord -L` to list devices.")
-    print("     Set AUDIO_SOURCE_FORMAT = \"alsa\" and AUDIO_SOURCE_DEVICE = <your_alsa_device_name> (e.g., 'hw:0,0', 'plughw:0,0').")
+    print("     Use format \"alsa\" and device <your_alsa_device_name> (e.g., 'hw:0,0', 'plughw:0,0').")
     print("3. Test ffmpeg directly in the terminal with the command shown in the script output to isolate issues.")
 
 if __name__ == "__main__":
@@ -0,0 +1,438 @@
+import argparse
+import collections
+import os
+import signal
+import subprocess
+import threading
+import time
+import types
+import zlib
+
+import pytest
+
+from src import main
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("90", 90),
+    ("1:30", 90),
+    ("01:00:00", 3600),
+    ("24:00:00", 86400),
+])
+def test_parse_duration(value, expected):
+    assert main._parse_duration(value) == expected
+
+
+@pytest.mark.parametrize("value", ["", "abc", "0", "0:00", "-5", "1:-1", "1:2:3:4", "1.5"])
+def test_parse_duration_rejects_invalid(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        main._parse_duration(value)
+
+
+def write_config(tmp_path, text):
+    path = tmp_path / "audio_capture.toml"
+    path.write_text(text)
+    return str(path)
+
+
+def test_parse_args_defaults():
+    args = main.parse_args([])
+    assert (args.output, args.duration, args.source, args.format, args.yes) == (None, None, None, None, False)
+
+
+def test_parse_args_reads_config(tmp_path):
+    config = write_config(tmp_path, 'output = "a.mp3"\nduration = "1:00:00"\nsource = "dev"\nformat = "alsa"\nyes = true\n')
+    args = main.parse_args(["--config", config])
+    assert (args.output, args.duration, args.source, args.format, args.yes) == ("a.mp3", 3600, "dev", "alsa", True)
+
+
+def test_parse_args_accepts_integer_duration_in_config(tmp_path):
+    config = write_config(tmp_path, "duration = 90\n")
+    assert main.parse_args(["--config", config]).duration == 90
+
+
+def test_parse_args_command_line_overrides_config(tmp_path):
+    config = write_config(tmp_path, 'output = "a.mp3"\nduration = 90\nsource = "dev"\n')
+    args = main.parse_args(["--config", config, "-o", "b.opus", "-d", "10"])
+    assert (args.output, args.duration, args.source) == ("b.opus", 10, "dev")
+
+
+@pytest.mark.parametrize("text", [
+    'yes = "no"\n',
+    "output = 5\n",
+    "source = 1\n",
+    "duration = true\n",
+    "duration = 1.5\n",
+    'duration = "soon"\n',
+    'output = "a.wav"\n',
+    "bitrate = 1\n",
+    "not toml\n",
+])
+def test_parse_args_rejects_bad_config(tmp_path, text):
+    config = write_config(tmp_path, text)
+    with pytest.raises(SystemExit):
+        main.parse_args(["--config", config])
+
+
+def test_parse_args_rejects_missing_config(tmp_path):
+    with pytest.raises(SystemExit):
+        main.parse_args(["--config", str(tmp_path / "missing.toml")])
+
+
+def test_parse_args_rejects_unsupported_output_extension():
+    with pytest.raises(SystemExit):
+        main.parse_args(["-o", "a.wav"])
+
+
+def test_segment_pattern():
+    assert main._segment_pattern("out/rec.opus") == "out/rec_%Y%m%d_%H%M%S.opus"
+
+
+def test_segment_pattern_escapes_percent():
+    assert main._segment_pattern("50%.mp3") == "50%%_%Y%m%d_%H%M%S.mp3"
+
+
+def local_timestamp(*fields):
+    return time.mktime((*fields, 0, 0, -1))
+
+
+def test_recorded_files_lists_this_recordings_segments(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "SEGMENT_DURATION_SECONDS", 3600)
+    for name, data in [
+        ("rec_20250101_110000.opus", b"earlier recording"),
+        ("rec_20250101_120000.opus", b"first"),
+        ("rec_20250101_130000.opus", b"second"),
+        ("rec_20250101_140000.opus", b""),
+        ("rec_20250101_150000.mp3", b"other format"),
+        ("record_20250101_120000.opus", b"other prefix"),
+        ("rec_2025_notes.opus", b"not a segment"),
+    ]:
+        (tmp_path / name).write_bytes(data)
+    started_at = local_timestamp(2025, 1, 1, 12, 0, 0)
+    assert main._recorded_files(str(tmp_path / "rec.opus"), started_at) == [
+        str(tmp_path / "rec_20250101_120000.opus"),
+        str(tmp_path / "rec_20250101_130000.opus"),
+    ]
+
+
+def test_recorded_files_handles_glob_characters(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "SEGMENT_DURATION_SECONDS", 3600)
+    (tmp_path / "[take 1]_20250101_120000.opus").write_bytes(b"data")
+    started_at = local_timestamp(2025, 1, 1, 12, 0, 0)
+    assert main._recorded_files(str(tmp_path / "[take 1].opus"), started_at) == [
+        str(tmp_path / "[take 1]_20250101_120000.opus"),
+    ]
+
+
+def test_recorded_files_single_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "SEGMENT_DURATION_SECONDS", 0)
+    output = tmp_path / "rec.opus"
+    assert main._recorded_files(str(output), 0) == []
+    output.write_bytes(b"")
+    assert main._recorded_files(str(output), 0) == []
+    output.write_bytes(b"data")
+    assert main._recorded_files(str(output), 0) == [str(output)]
+
+
+def run_output_writer(blocks, fd):
+    queue = collections.deque(blocks)
+    queue.append(None)
+    main._write_output_blocks(fd, queue, threading.Condition())
+
+
+def test_write_output_blocks_handles_partial_writes(tmp_path, monkeypatch):
+    real_writev = os.writev
+    calls = []
+
+    def short_writev(fd, buffers):
+        calls.append(len(buffers))
+        # Write at most 5 bytes per call, splitting blocks mid-way
+        return real_writev(fd, [b"".join(bytes(b) for b in buffers)[:5]])
+
+    monkeypatch.setattr(main.os, "writev", short_writev)
+    path = tmp_path / "out.opus"
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT)
+    run_output_writer([b"abc", b"defghij", b"", b"klmnopqrstu"], fd)
+    assert path.read_bytes() == b"abcdefghijklmnopqrstu"
+    assert len(calls) == 5
+    with pytest.raises(OSError):
+        os.fstat(fd)  # closed by the writer
+
+
+def test_write_output_blocks_discards_output_after_a_failed_write(tmp_path, monkeypatch, capsys):
+    calls = []
+
+    def failing_writev(fd, buffers):
+        calls.append(buffers)
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(main.os, "writev", failing_writev)
+    fd = os.open(tmp_path / "out.opus", os.O_WRONLY | os.O_CREAT)
+    run_output_writer([b"abc", b"def"], fd)
+    assert len(calls) == 1
+    assert "No space left on device" in capsys.readouterr().out
+
+
+def test_buffered_output_copies_pipe_to_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "OUTPUT_BLOCK_SIZE", 7)
+    monkeypatch.setattr(main, "OUTPUT_BUFFER_BLOCKS", 2)
+    data = bytes(range(256)) * 40
+    read_fd, write_fd = os.pipe()
+    path = tmp_path / "out.opus"
+    with open(read_fd, "rb") as stream:
+        threads = main._start_buffered_output(stream, os.open(path, os.O_WRONLY | os.O_CREAT))
+        os.write(write_fd, data)
+        os.close(write_fd)
+        for thread in threads:
+            thread.join(timeout=10)
+    assert not any(thread.is_alive() for thread in threads)
+    assert path.read_bytes() == data
+
+
+PACTL_SHORT_OUTPUT = (
+    "0\talsa_input.pci-0000_00_1f.3.analog-stereo\tPipeWire\ts32le 2ch 48000Hz\tSUSPENDED\n"
+    "1\talsa_output.pci-0000_00_1f.3.analog-stereo.monitor\tPipeWire\ts32le 2ch 48000Hz\tIDLE\n"
+    "2\tbluez_output.00_11_22.monitor\tPipeWire\ts16le 2ch 44100Hz\tIDLE\n"
+)
+
+
+def fake_pactl(monkeypatch, stdout="", returncode=0, error=None):
+    calls = []
+
+    def run(args, **kwargs):
+        calls.append((args, kwargs))
+        if error is not None:
+            raise error
+        return subprocess.CompletedProcess(args, returncode, stdout=stdout)
+
+    monkeypatch.setattr(main.subprocess, "run", run)
+    return calls
+
+
+def test_detect_monitor_source_returns_first_monitor(monkeypatch):
+    calls = fake_pactl(monkeypatch, PACTL_SHORT_OUTPUT)
+    assert main.detect_pulseaudio_monitor_source() == "alsa_output.pci-0000_00_1f.3.analog-stereo.monitor"
+    [(args, kwargs)] = calls
+    assert args == ["pactl", "list", "sources", "short"]
+    assert kwargs["timeout"] == main.PACTL_TIMEOUT_SECONDS
+
+
+@pytest.mark.parametrize("stdout", ["", "\n", "0\talsa_input.foo\tPipeWire\ts16le 2ch 44100Hz\tIDLE\n", "garbage\n"])
+def test_detect_monitor_source_without_monitors(monkeypatch, stdout):
+    fake_pactl(monkeypatch, stdout)
+    assert main.detect_pulseaudio_monitor_source() is None
+
+
+def test_detect_monitor_source_when_pactl_fails(monkeypatch):
+    fake_pactl(monkeypatch, PACTL_SHORT_OUTPUT, returncode=1)
+    assert main.detect_pulseaudio_monitor_source() is None
+
+
+@pytest.mark.parametrize("error", [FileNotFoundError("pactl"), subprocess.TimeoutExpired("pactl", 2.0)])
+def test_detect_monitor_source_when_pactl_is_unavailable(monkeypatch, error):
+    fake_pactl(monkeypatch, error=error)
+    assert main.detect_pulseaudio_monitor_source() is None
+
+
+def test_record_audio_ffmpeg_reports_unopenable_output_file(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(main, "SEGMENT_DURATION_SECONDS", 0)
+    monkeypatch.setattr(main, "check_ffmpeg_installed", lambda: "/usr/bin/ffmpeg")
+
+    def popen(*args, **kwargs):
+        raise AssertionError("ffmpeg must not be started")
+
+    monkeypatch.setattr(main.subprocess, "Popen", popen)
+    output = tmp_path / "missing" / "rec.opus"
+    main.record_audio_ffmpeg(str(output), 5, "pulse", "default")
+    out = capsys.readouterr().out
+    assert f"Error: cannot open output file {output}" in out
+    assert "ffmpeg command not found" not in out
+
+
+def test_parse_args_backend(tmp_path):
+    assert main.parse_args(["--backend", "pyav"]).backend == "pyav"
+    assert main.parse_args(["--config", write_config(tmp_path, 'backend = "pyav"\n')]).backend == "pyav"
+    with pytest.raises(SystemExit):
+        main.parse_args(["--backend", "gstreamer"])
+    with pytest.raises(SystemExit):
+        main.parse_args(["--config", write_config(tmp_path, 'backend = "gstreamer"\n')])
+
+
+@pytest.mark.parametrize("argv, backend", [
+    (["-y"], "ffmpeg"),
+    (["-y", "--backend", "ffmpeg"], "ffmpeg"),
+    (["-y", "--backend", "pyav"], "pyav"),
+])
+def test_main_dispatches_to_backend(monkeypatch, argv, backend):
+    calls = []
+    monkeypatch.setattr(main, "detect_pulseaudio_monitor_source", lambda: None)
+    monkeypatch.setattr(main, "record_audio_ffmpeg", lambda *args: calls.append("ffmpeg"))
+    monkeypatch.setattr(main, "record_audio_pyav", lambda *args: calls.append("pyav"))
+    main.main(argv)
+    assert calls == [backend]
+
+
+SINE_SOURCE = ("lavfi", "sine=frequency=440:sample_rate=44100")
+
+
+@pytest.mark.parametrize("filename", ["rec.opus", "rec.mp3"])
+def test_record_audio_pyav(tmp_path, monkeypatch, capsys, filename):
+    av = pytest.importorskip("av")
+    monkeypatch.setattr(main, "SEGMENT_DURATION_SECONDS", 0)
+    output = tmp_path / filename
+    main.record_audio_pyav(str(output), 2, *SINE_SOURCE)
+    assert f"Audio saved to {output}" in capsys.readouterr().out
+    with av.open(str(output)) as container:
+        stream = container.streams.audio[0]
+        assert stream.codec_context.name == ("opus" if filename.endswith(".opus") else "mp3float")
+        assert stream.layout.name == "stereo"
+        assert container.duration / av.time_base == pytest.approx(2, abs=0.1)
+
+
+def test_record_audio_pyav_survives_write_errors(tmp_path, monkeypatch, capsys):
+    av = pytest.importorskip("av")
+
+    def failing_mux(self, packets):
+        raise av.error.FFmpegError(28, "No space left on device")
+
+    monkeypatch.setattr(main, "SEGMENT_DURATION_SECONDS", 0)
+    monkeypatch.setattr(av.container.OutputContainer, "mux", failing_mux)
+    main.record_audio_pyav(str(tmp_path / "rec.opus"), 2, *SINE_SOURCE)
+    out = capsys.readouterr().out
+    assert "Error during PyAV recording" in out
+    assert "Error finalizing the recording" in out
+
+
+@pytest.fixture
+def fake_ffmpeg_lookup(monkeypatch):
+    """Stubs shutil.which and os.stat for _ffmpeg_path; returns the mutable fake state."""
+    state = {"which": "/usr/bin/ffmpeg", "mtime_ns": 1, "which_calls": 0}
+
+    def fake_which(name):
+        assert name == "ffmpeg"
+        state["which_calls"] += 1
+        return state["which"]
+
+    real_stat = os.stat
+
+    def fake_stat(path, *args, **kwargs):
+        if not str(path).endswith("/ffmpeg"):
+            return real_stat(path, *args, **kwargs)
+        if state["mtime_ns"] is None:
+            raise FileNotFoundError(path)
+        return types.SimpleNamespace(st_mtime_ns=state["mtime_ns"])
+
+    monkeypatch.setattr(main, "_ffmpeg_cache", None)
+    monkeypatch.setattr(main.shutil, "which", fake_which)
+    monkeypatch.setattr(main.os, "stat", fake_stat)
+    return state
+
+
+def test_ffmpeg_path_cache_hit_skips_which(fake_ffmpeg_lookup):
+    assert main._ffmpeg_path() == "/usr/bin/ffmpeg"
+    assert main._ffmpeg_path() == "/usr/bin/ffmpeg"
+    assert fake_ffmpeg_lookup["which_calls"] == 1
+
+
+def test_ffmpeg_path_changed_mtime_looks_up_again(fake_ffmpeg_lookup):
+    assert main._ffmpeg_path() == "/usr/bin/ffmpeg"
+    fake_ffmpeg_lookup["mtime_ns"] = 2
+    fake_ffmpeg_lookup["which"] = "/usr/local/bin/ffmpeg"
+    assert main._ffmpeg_path() == "/usr/local/bin/ffmpeg"
+    assert fake_ffmpeg_lookup["which_calls"] == 2
+    assert main._ffmpeg_cache == ("/usr/local/bin/ffmpeg", 2)
+
+
+def test_ffmpeg_path_vanished_binary_clears_cache(fake_ffmpeg_lookup):
+    assert main._ffmpeg_path() == "/usr/bin/ffmpeg"
+    fake_ffmpeg_lookup["mtime_ns"] = None
+    fake_ffmpeg_lookup["which"] = None
+    assert main._ffmpeg_path() is None
+    assert main._ffmpeg_cache is None
+    assert fake_ffmpeg_lookup["which_calls"] == 2
+
+
+def test_main_handles_sigterm_only_while_recording(monkeypatch):
+    handlers = []
+    monkeypatch.setattr(main, "detect_pulseaudio_monitor_source", lambda: None)
+    monkeypatch.setattr(main, "record_audio_ffmpeg",
+                        lambda *args: handlers.append(signal.getsignal(signal.SIGTERM)))
+    previous = signal.getsignal(signal.SIGTERM)
+    main.main(["-y"])
+    assert handlers == [main._stop_on_sigterm]
+    assert signal.getsignal(signal.SIGTERM) is previous
+
+
+class FakeProcess:
+    """Stands in for the ffmpeg Popen; wait() times out for the first `timeouts` calls."""
+
+    def __init__(self, timeouts=0, stdin_error=None):
+        self.timeouts = timeouts
+        self.stdin_error = stdin_error
+        self.stdin = self
+        self.written = b""
+        self.calls = []
+
+    def write(self, data):
+        self.written += data
+
+    def close(self):
+        # Like a buffered pipe, the flush in close() is what fails once ffmpeg has exited.
+        self.calls.append("close")
+        if self.stdin_error:
+            raise self.stdin_error
+
+    def wait(self, timeout=None):
+        self.calls.append(("wait", timeout))
+        if self.timeouts:
+            self.timeouts -= 1
+            raise subprocess.TimeoutExpired("ffmpeg", timeout)
+        return 0
+
+    def terminate(self):
+        self.calls.append("terminate")
+
+    def kill(self):
+        self.calls.append("kill")
+
+
+@pytest.mark.parametrize("stdin_error", [None, BrokenPipeError()])
+def test_stop_ffmpeg_asks_to_quit(capsys, stdin_error):
+    process = FakeProcess(stdin_error=stdin_error)
+    main._stop_ffmpeg(process)
+    assert process.written == b"q\n"
+    assert process.calls == ["close", ("wait", main.FFMPEG_STOP_TIMEOUT_SECONDS)]
+    assert "exited cleanly" in capsys.readouterr().out
+
+
+def test_stop_ffmpeg_terminates_when_quit_is_ignored(capsys):
+    process = FakeProcess(timeouts=1)
+    main._stop_ffmpeg(process)
+    assert process.calls == ["close", ("wait", main.FFMPEG_STOP_TIMEOUT_SECONDS), "terminate", ("wait", 5)]
+    assert "ffmpeg process terminated." in capsys.readouterr().out
+
+
+def test_stop_ffmpeg_kills_when_terminate_is_ignored(capsys):
+    process = FakeProcess(timeouts=2)
+    main._stop_ffmpeg(process)
+    assert process.calls == ["close", ("wait", main.FFMPEG_STOP_TIMEOUT_SECONDS), "terminate", ("wait", 5),
+                             "kill", ("wait", None)]
+    assert "forcing" in capsys.readouterr().out
+
+
+def test_verify_output_prints_size_and_crc(tmp_path, monkeypatch, capsys):
+    data = os.urandom(1000)
+    path = tmp_path / "rec.opus"
+    path.write_bytes(data)
+    monkeypatch.setattr(main, "VERIFY_CHUNK_SIZE", 7)
+    main._verify_output(str(path))
+    assert capsys.readouterr().out == f"  {path}: 1000 bytes, CRC32 {zlib.crc32(data):08x}\n"
+
+
+@pytest.mark.parametrize("create", [False, True])
+def test_verify_output_reports_unreadable_files(tmp_path, capsys, create):
+    path = tmp_path / "rec.opus"
+    if create:
+        path.write_bytes(b"")  # mmap refuses empty files with ValueError
+    main._verify_output(str(path))
+    assert capsys.readouterr().out.startswith(f"  {path}: could not verify: ")